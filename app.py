@@ -1,8 +1,16 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_file, make_response
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, send_file, make_response, Response, stream_with_context
 from logic.greedy_optimizer import greedy_optimizer
 from logic.dp_emi_selector import dp_emi_selector
 from logic.decision_tree_advice import decision_tree_advice
 from logic.backtrack_expenses import backtrack_expenses
+from logic.log_compaction import compact_storage, acquire_compaction_lock, release_compaction_lock
+from logic.report_index import report_prefix, report_timestamp, list_reports, append_report, reserve_report_filename
+from logic.lean_response import lean_results, select_fields, parse_fields
+from logic.cohort_stats import (
+    income_band, observation_from_log, load_cohort_stats, save_cohort_stats, rebuild_cohort_stats,
+    cohort_lock_path, contributor_id, CONTRIBUTOR_CAP
+)
+from logic.file_lock import acquire_file_lock, release_file_lock
 from typing import List, Dict
 import json
 import google.generativeai as genai
@@ -14,6 +22,12 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 from calendar import month_name
 import shutil
+import threading
+import click
+import csv
+import io
+import zipfile
+import gzip
 
 # Load environment variables
 load_dotenv()
@@ -40,6 +54,27 @@ for folder in ['results', 'data', 'users']:
     if not os.path.exists(folder):
         os.makedirs(folder)
 
+# Retention for the compaction job: raw per-run logs kept per user, and saved reports kept per
+# user. Report pruning is off unless KEEP_REPORTS is set, since /api/export can only return kept reports.
+KEEP_RAW_RUNS = int(os.getenv('KEEP_RAW_RUNS', '6'))
+KEEP_REPORTS = int(os.getenv('KEEP_REPORTS')) if os.getenv('KEEP_REPORTS') else None
+# Hours between background compactions, run by each serving process from its first request;
+# 0 leaves it to `flask compact-logs`
+COMPACTION_INTERVAL_HOURS = float(os.getenv('COMPACTION_INTERVAL_HOURS', '0'))
+
+# JSON responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+
+# Cross-user benchmarks; bands and categories with fewer distinct users than COHORT_MIN_SIZE are not shown.
+# Distinct users are only tracked up to CONTRIBUTOR_CAP, so the minimum cannot exceed it.
+COHORT_STATS_FILE = 'cohort_stats.json'
+COHORT_MIN_SIZE = min(int(os.getenv('COHORT_MIN_SIZE', '5')), CONTRIBUTOR_CAP)
+cohort_stats = load_cohort_stats(COHORT_STATS_FILE)
+cohort_stats_mtime = os.path.getmtime(COHORT_STATS_FILE) if os.path.exists(COHORT_STATS_FILE) else None
+cohort_stats_lock = threading.Lock()
+# Seconds /analyze waits for the cross-process cohort lock before skipping the update
+COHORT_LOCK_TIMEOUT = 10.0
+
 # Helper to load users
 def load_users():
     if not os.path.exists(USERS_FILE):
@@ -186,15 +221,13 @@ def analyze_expenses_by_category(expenses: List[Dict]) -> Dict:
 
 def save_results_to_json(results: Dict, user_name: str):
     """Save results to a JSON file in the results/ directory."""
-    safe_filename = "".join(c for c in user_name if c.isalnum() or c in (' ', '-', '_')).strip()
-    safe_filename = safe_filename.replace(' ', '_').lower()
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{safe_filename}_{timestamp}.json"
     results_dir = "results"
     if not os.path.exists(results_dir):
         os.makedirs(results_dir)
-    filepath = os.path.join(results_dir, filename)
     try:
+        filename = reserve_report_filename(results_dir, user_name, timestamp)
+        filepath = os.path.join(results_dir, filename)
         if 'smart_model_summary' in results and 'formatted_analysis' in results['smart_model_summary']:
             formatted_text = results['smart_model_summary']['formatted_analysis']
             formatted_text = formatted_text.replace('\n', '\\n').replace('"', '\\"')
@@ -211,10 +244,100 @@ def save_results_to_json(results: Dict, user_name: str):
         with open(filepath, 'w', encoding='utf-8') as f:
             f.write(content)
 
+        append_report(USERS_DIR, results_dir, user_name, filename)
         return filename  # Return just the filename, not the full path
     except Exception as e:
         return None
 
+def refresh_cohort_stats():
+    """Reload cohort stats if another process (e.g. a rebuild) replaced the file. Call under the lock."""
+    global cohort_stats, cohort_stats_mtime
+    mtime = os.path.getmtime(COHORT_STATS_FILE) if os.path.exists(COHORT_STATS_FILE) else None
+    if mtime != cohort_stats_mtime:
+        cohort_stats = load_cohort_stats(COHORT_STATS_FILE)
+        cohort_stats_mtime = mtime
+
+def write_run_log(log_path: str, log: Dict, username: str):
+    """
+    Write one analysis log and fold it into the cohort stats, both under the cohort file lock.
+    A concurrent `flask rebuild-cohort-stats` takes the same lock for its final catch-up scan,
+    so the log is counted either by the rebuild or by this update, never both or neither.
+    """
+    global cohort_stats_mtime
+    with cohort_stats_lock:
+        locked = acquire_file_lock(cohort_lock_path(COHORT_STATS_FILE), COHORT_LOCK_TIMEOUT)
+        try:
+            with open(log_path, 'w', encoding='utf-8') as f:
+                json.dump(log, f, indent=2, ensure_ascii=False)
+            if not locked:
+                print("Warning: cohort stats are locked; this analysis will be counted by the next rebuild.")
+                return
+            try:
+                refresh_cohort_stats()
+                cohort_stats.add_log(log, contributor_id(username, app.secret_key))
+                save_cohort_stats(cohort_stats, COHORT_STATS_FILE)
+                cohort_stats_mtime = os.path.getmtime(COHORT_STATS_FILE)
+            except Exception as e:
+                print(f"Warning: could not update cohort stats: {e}")
+        finally:
+            if locked:
+                release_file_lock(cohort_lock_path(COHORT_STATS_FILE))
+
+def build_analysis_results(user_name: str, salary: float, expenses: List[Dict], emi_plans: List[Dict],
+                           bank_statement: Dict, target_savings: float, use_ai: bool = True) -> Dict:
+    """Run the optimizers and advice engines and assemble the full results dict."""
+    # Separate fixed and reducible expenses
+    fixed_expenses = [exp for exp in expenses if exp.get('expense_type') == 'Fixed']
+    reducible_expenses = [exp for exp in expenses if exp.get('expense_type') == 'Reducible']
+
+    # Calculate totals for fixed and EMI before optimization
+    total_fixed = sum(e.get('amount', 0) for e in fixed_expenses)
+    emi_total = 0
+    emi_recommendation = dp_emi_selector(emi_plans, salary)
+    if emi_recommendation and 'selected_plans' in emi_recommendation:
+        emi_total = sum(plan.get('monthlyPayment', 0) for plan in emi_recommendation['selected_plans'])
+
+    # Run optimization only on reducible expenses (now with net savings logic)
+    optimized_reducible_expenses, optimizer_status = greedy_optimizer(
+        reducible_expenses, salary, total_fixed, emi_total, target_savings
+    )
+
+    # Merge fixed expenses back with optimized reducible expenses
+    optimized_expenses = fixed_expenses + optimized_reducible_expenses
+
+    advice = decision_tree_advice(optimized_expenses, emi_recommendation, salary)
+    # Get AI advice
+    if use_ai:
+        ai_advice = get_ai_advice(optimized_expenses, salary, emi_plans, bank_statement)
+    else:
+        ai_advice = {'detailed_analysis': [], 'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+
+    # Calculate balance and savings
+    total_optimized = sum(e.get('amount', 0) for e in optimized_expenses)
+    balance = salary - total_fixed - total_optimized
+    savings_rate = (balance / salary) if salary > 0 else 0
+
+    # Prepare results
+    results = {
+        'user_name': user_name,
+        'salary': salary,
+        'target_savings': target_savings,
+        'expenses': expenses,
+        'optimized_expenses': optimized_expenses,
+        'emi_recommendation': emi_recommendation,
+        'advice': advice,
+        'smart_model_summary': ai_advice,
+        'bank_statement': bank_statement,
+        'balance': balance,
+        'savings_rate': savings_rate,
+        'amount_saved': optimizer_status.get('actual_savings', 0),
+        'total_possible_savings': optimizer_status.get('total_possible_savings', 0),
+        'gap_remaining': optimizer_status.get('gap_remaining', 0),
+        'goal_met': optimizer_status.get('savings_goal_reached', False),
+        'status_message': optimizer_status.get('status_message', '')
+    }
+    return results
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -295,53 +418,9 @@ def analyze():
         if target_savings < 0:
             return jsonify({'success': False, 'error': 'Target savings must be a positive number.'}), 400
         
-        # Separate fixed and reducible expenses
-        fixed_expenses = [exp for exp in expenses if exp.get('expense_type') == 'Fixed']
-        reducible_expenses = [exp for exp in expenses if exp.get('expense_type') == 'Reducible']
-
-        # Calculate totals for fixed and EMI before optimization
-        total_fixed = sum(e.get('amount', 0) for e in fixed_expenses)
-        emi_total = 0
-        emi_recommendation = dp_emi_selector(emi_plans, salary)
-        if emi_recommendation and 'selected_plans' in emi_recommendation:
-            emi_total = sum(plan.get('monthlyPayment', 0) for plan in emi_recommendation['selected_plans'])
-
-        # Run optimization only on reducible expenses (now with net savings logic)
-        optimized_reducible_expenses, optimizer_status = greedy_optimizer(
-            reducible_expenses, salary, total_fixed, emi_total, target_savings
-        )
-
-        # Merge fixed expenses back with optimized reducible expenses
-        optimized_expenses = fixed_expenses + optimized_reducible_expenses
-
-        advice = decision_tree_advice(optimized_expenses, emi_recommendation, salary)
-        # Get AI advice
-        ai_advice = get_ai_advice(optimized_expenses, salary, emi_plans, bank_statement)
-
-        # Calculate balance and savings
-        total_optimized = sum(e.get('amount', 0) for e in optimized_expenses)
-        balance = salary - total_fixed - total_optimized
-        savings_rate = (balance / salary) if salary > 0 else 0
-
-        # Prepare results
-        results = {
-            'user_name': user_name,
-            'salary': salary,
-            'target_savings': target_savings,
-            'expenses': expenses,
-            'optimized_expenses': optimized_expenses,
-            'emi_recommendation': emi_recommendation,
-            'advice': advice,
-            'smart_model_summary': ai_advice,
-            'bank_statement': bank_statement,
-            'balance': balance,
-            'savings_rate': savings_rate,
-            'amount_saved': optimizer_status.get('actual_savings', 0),
-            'total_possible_savings': optimizer_status.get('total_possible_savings', 0),
-            'gap_remaining': optimizer_status.get('gap_remaining', 0),
-            'goal_met': optimizer_status.get('savings_goal_reached', False),
-            'status_message': optimizer_status.get('status_message', '')
-        }
+        results = build_analysis_results(user_name, salary, expenses, emi_plans, bank_statement, target_savings)
+        balance = results['balance']
+        savings_rate = results['savings_rate']
 
         # Save results to JSON
         filename = save_results_to_json(results, user_name)
@@ -359,7 +438,7 @@ def analyze():
             'reducible_expenses': [e for e in expenses if e.get('expense_type') == 'Reducible'],
             'optimized_expenses': results.get('optimized_expenses'),
             'emi_plans': emi_plans,
-            'selected_emis': results.get('selected_emis'),
+            'selected_emis': (results.get('emi_recommendation') or {}).get('selected_plans'),
             'balance': balance,
             'savings_rate': savings_rate,
             'alerts': results.get('alerts'),
@@ -380,8 +459,13 @@ def analyze():
                     monthly_log[key] = 0
                 else:
                     monthly_log[key] = ""
-        with open(log_path, 'w', encoding='utf-8') as f:
-            json.dump(monthly_log, f, indent=2, ensure_ascii=False)
+        write_run_log(log_path, monthly_log, user_name)
+
+        # Lean mode drops echoed inputs; `fields` narrows either mode to the listed keys
+        response_mode = request.args.get('mode') or data.get('response_mode', 'full')
+        if response_mode == 'lean':
+            results = lean_results(results, expenses, emi_plans)
+        results = select_fields(results, parse_fields(request.args.get('fields') or data.get('fields')))
 
         return jsonify({
             'success': True,
@@ -395,6 +479,26 @@ def analyze():
             'error': str(e)
         }), 400
 
+@app.after_request
+def compress_response(response):
+    """Gzip JSON responses for clients that accept it; streamed and file responses are left alone."""
+    if (response.mimetype != 'application/json'
+            or not 200 <= response.status_code < 300
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    # q-value of gzip (also matched by "*"); "gzip;q=0" means the client refuses it
+    if request.accept_encodings['gzip'] <= 0:
+        return response
+    response.set_data(gzip.compress(body))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 @app.route('/api/past_reports')
 @login_required
 def api_past_reports():
@@ -404,26 +508,30 @@ def api_past_reports():
     if os.path.exists(user_dir):
         files = sorted([f for f in os.listdir(user_dir) if f.endswith('.json')], reverse=True)
         for f in files[:6]:
-            with open(os.path.join(user_dir, f), 'r', encoding='utf-8') as fp:
-                log = json.load(fp)
-                # Compose summary for table/charts
-                # Extract timestamp from filename for display
-                ts = f.replace(f'{username}_','').replace('.json','')
-                total_expenses = sum(e['amount'] for e in log.get('fixed_expenses',[])) + sum(e['amount'] for e in log.get('reducible_expenses',[]))
-                category_expenses = {}
-                for e in log.get('fixed_expenses',[]) + log.get('reducible_expenses',[]):
-                    cat = e.get('category','Other')
-                    category_expenses[cat] = category_expenses.get(cat,0) + e.get('amount',0)
-                top_categories = sorted(category_expenses, key=category_expenses.get, reverse=True)[:2]
-                logs.append({
-                    'month': ts,
-                    'total_expenses': total_expenses,
-                    'balance': log.get('balance',0),
-                    'savings_rate': log.get('savings_rate',0),
-                    'top_categories': top_categories,
-                    'category_expenses': category_expenses,
-                    'analysis': log.get('analysis',[])
-                })
+            try:
+                with open(os.path.join(user_dir, f), 'r', encoding='utf-8') as fp:
+                    log = json.load(fp)
+            except FileNotFoundError:
+                # Rolled into a monthly file by compaction since the listing
+                continue
+            # Compose summary for table/charts
+            # Extract timestamp from filename for display
+            ts = f.replace(f'{username}_','').replace('.json','')
+            total_expenses = sum(e['amount'] for e in log.get('fixed_expenses',[])) + sum(e['amount'] for e in log.get('reducible_expenses',[]))
+            category_expenses = {}
+            for e in log.get('fixed_expenses',[]) + log.get('reducible_expenses',[]):
+                cat = e.get('category','Other')
+                category_expenses[cat] = category_expenses.get(cat,0) + e.get('amount',0)
+            top_categories = sorted(category_expenses, key=category_expenses.get, reverse=True)[:2]
+            logs.append({
+                'month': ts,
+                'total_expenses': total_expenses,
+                'balance': log.get('balance',0),
+                'savings_rate': log.get('savings_rate',0),
+                'top_categories': top_categories,
+                'category_expenses': category_expenses,
+                'analysis': log.get('analysis',[])
+            })
         logs = list(reversed(logs))
     # If no logs, return empty logs
     return jsonify({'logs': logs})
@@ -437,8 +545,12 @@ def api_financial_score():
     if os.path.exists(user_dir):
         files = sorted([f for f in os.listdir(user_dir) if f.endswith('.json')], reverse=True)
         for f in files[:6]:
-            with open(os.path.join(user_dir, f), 'r', encoding='utf-8') as fp:
-                logs.append(json.load(fp))
+            try:
+                with open(os.path.join(user_dir, f), 'r', encoding='utf-8') as fp:
+                    logs.append(json.load(fp))
+            except FileNotFoundError:
+                # Rolled into a monthly file by compaction since the listing
+                continue
         logs = list(reversed(logs))
     score = 0
     suggestions = []
@@ -489,17 +601,248 @@ def api_financial_score():
         summary = 'Risky: Take action to improve your finances.'
     return jsonify({'score': score, 'emoji': emoji, 'summary': summary, 'suggestions': suggestions})
 
+@app.route('/api/cohort_stats')
+@login_required
+def api_cohort_stats():
+    """
+    Benchmark the user's latest analysis against others in the same income band.
+    Counts, means, quantiles and percentiles are per analysis, not per user: someone who
+    re-runs often weighs more. Only the cohort-size thresholds count distinct users.
+    """
+    username = session['username']
+    user_dir = os.path.join('data', username)
+    observation = None
+    if os.path.exists(user_dir):
+        for f in sorted([f for f in os.listdir(user_dir) if f.endswith('.json')], reverse=True):
+            try:
+                with open(os.path.join(user_dir, f), 'r', encoding='utf-8') as fp:
+                    observation = observation_from_log(json.load(fp))
+            except FileNotFoundError:
+                continue
+            break
+    with cohort_stats_lock:
+        refresh_cohort_stats()
+        bands = cohort_stats.summary(COHORT_MIN_SIZE)
+        your_band = None
+        you = None
+        if observation and observation[0] > 0:
+            income, category_spend, savings_rate, emi_total, _ = observation
+            your_band = income_band(income)
+            if your_band in bands:
+                you = {
+                    'savings_rate': savings_rate,
+                    'emi_to_income': emi_total / income,
+                    'category_expenses': category_spend,
+                    'percentiles': cohort_stats.percentiles(income, category_spend, savings_rate, emi_total, COHORT_MIN_SIZE)
+                }
+    return jsonify({'bands': bands, 'your_band': your_band, 'you': you, 'min_cohort_size': COHORT_MIN_SIZE,
+                    'sample_unit': 'analysis'})
+
 @app.route('/api/download_report')
 @login_required
 def api_download_report():
     username = session['username']
     if not os.path.exists('results'):
         return make_response('No report found (results folder missing).', 404)
-    user_files = sorted([f for f in os.listdir('results') if f.startswith(username)], reverse=True)
-    if user_files:
-        latest = user_files[0]
-        return send_file(os.path.join('results', latest), as_attachment=True, download_name=f"{username}_{datetime.now().strftime('%Y_%m')}_analysis.json")
+    for latest in reversed(list_reports(USERS_DIR, 'results', username)):
+        latest_path = os.path.join('results', latest)
+        if os.path.exists(latest_path):
+            return send_file(latest_path, as_attachment=True, download_name=f"{username}_{datetime.now().strftime('%Y_%m')}_analysis.json")
     return make_response('No report found.', 404)
 
+EXPORT_CSV_COLUMNS = [
+    'timestamp', 'salary', 'target_savings', 'total_expenses', 'total_optimized_expenses',
+    'balance', 'savings_rate', 'amount_saved', 'gap_remaining', 'goal_met', 'status_message'
+]
+EXPORT_MIMETYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'zip': 'application/zip'
+}
+# Read size when copying reports into a streamed ZIP
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+def iter_user_reports(username: str, start: datetime = None, end: datetime = None):
+    """Yield (filename, path, run time) for the user's reports in a date range, oldest first."""
+    for filename in list_reports(USERS_DIR, 'results', username):
+        ts = report_timestamp(filename)
+        if ts is None or (start and ts < start):
+            continue
+        if end and ts > end:
+            break
+        path = os.path.join('results', filename)
+        if os.path.exists(path):
+            yield filename, path, ts
+
+def load_report(path: str):
+    """Load a saved report; older reports contain raw newlines inside strings."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f, strict=False)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def export_csv(reports):
+    """Stream one summary row per report."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    for filename, path, ts in reports:
+        report = load_report(path)
+        if report is None:
+            continue
+        writer.writerow([
+            ts.isoformat(),
+            report.get('salary', 0),
+            report.get('target_savings', 0),
+            sum(e.get('amount', 0) for e in report.get('expenses') or []),
+            sum(e.get('amount', 0) for e in report.get('optimized_expenses') or []),
+            report.get('balance', 0),
+            report.get('savings_rate', 0),
+            report.get('amount_saved', 0),
+            report.get('gap_remaining', 0),
+            report.get('goal_met', False),
+            report.get('status_message', '')
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
+def export_jsonl(reports):
+    """Stream one full report per line."""
+    for filename, path, ts in reports:
+        report = load_report(path)
+        if report is None:
+            continue
+        report['report_file'] = filename
+        yield json.dumps(report, ensure_ascii=False) + '\n'
+
+class _ZipStream:
+    """Write-only sink for ZipFile; the generator drains it after every chunk."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def export_zip(reports):
+    """Stream a ZIP of the original report files without building it in memory."""
+    sink = _ZipStream()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for filename, path, ts in reports:
+            try:
+                src = open(path, 'rb')
+            except FileNotFoundError:
+                continue
+            with src, zf.open(filename, 'w') as dest:
+                for chunk in iter(lambda: src.read(EXPORT_CHUNK_SIZE), b''):
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+EXPORT_WRITERS = {
+    'csv': export_csv,
+    'jsonl': export_jsonl,
+    'zip': export_zip
+}
+
+def parse_export_date(value: str, end_of_day: bool = False):
+    """Parse a YYYY-MM-DD query parameter; `end` covers the whole day."""
+    if not value:
+        return None
+    day = datetime.strptime(value, '%Y-%m-%d')
+    return day.replace(hour=23, minute=59, second=59) if end_of_day else day
+
+@app.route('/api/export')
+@login_required
+def api_export():
+    """Stream the user's report history as CSV, JSONL or a ZIP of reports."""
+    username = session['username']
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_WRITERS:
+        return jsonify({'success': False, 'error': f"Unsupported format '{fmt}'. Use csv, jsonl or zip."}), 400
+    try:
+        start = parse_export_date(request.args.get('start'))
+        end = parse_export_date(request.args.get('end'), end_of_day=True)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Dates must be in YYYY-MM-DD format.'}), 400
+    reports = iter_user_reports(username, start, end)
+    download_name = f"{report_prefix(username)}_reports.{fmt}"
+    # No Content-Length is set, so the body goes out with chunked transfer encoding
+    return Response(
+        stream_with_context(EXPORT_WRITERS[fmt](reports)),
+        mimetype=EXPORT_MIMETYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{download_name}"'}
+    )
+
+@app.cli.command('compact-logs')
+@click.option('--keep-runs', default=KEEP_RAW_RUNS, show_default=True, help='Raw per-run logs to keep per user.')
+@click.option('--keep-reports', type=int, default=KEEP_REPORTS,
+              help='Saved reports to keep per user in results/. Off by default; pruned reports '
+                   'are deleted and no longer returned by /api/export.')
+@click.option('--user', 'users', multiple=True, help='Only compact these users (repeatable).')
+def compact_logs_command(keep_runs, keep_reports, users):
+    """Roll old per-run logs into monthly files and, with --keep-reports, prune old reports."""
+    summary = compact_storage('data', 'results', USERS_DIR, keep_runs, keep_reports, list(users) or None,
+                             secret_key=app.secret_key)
+    click.echo(json.dumps(summary, indent=2))
+
+@app.cli.command('rebuild-cohort-stats')
+@click.option('--workers', default=None, type=int, help='Worker processes (defaults to the CPU count).')
+def rebuild_cohort_stats_command(workers):
+    """Recompute cohort stats from every log under data/, in parallel. Safe while the app is serving."""
+    compaction_lock = acquire_compaction_lock('data')
+    if compaction_lock is None:
+        raise click.ClickException('A compaction is running; try again when it finishes.')
+    try:
+        stats = rebuild_cohort_stats('data', COHORT_STATS_FILE, app.secret_key, workers)
+    finally:
+        release_compaction_lock(compaction_lock)
+    counts = {label: band['count'] for label, band in stats.summary().items()}
+    click.echo(json.dumps({'bands': counts}, indent=2))
+
+def start_background_compaction(interval_hours: float):
+    """Run compaction periodically in a daemon thread alongside the web app."""
+    def loop():
+        while not stop_event.wait(interval_hours * 3600):
+            try:
+                compact_storage('data', 'results', USERS_DIR, KEEP_RAW_RUNS, KEEP_REPORTS, secret_key=app.secret_key)
+            except Exception as e:
+                # Keep the thread alive; the next interval retries
+                print(f"Warning: background compaction failed: {e}")
+    stop_event = threading.Event()
+    threading.Thread(target=loop, name='log-compaction', daemon=True).start()
+    return stop_event
+
+compaction_started = False
+compaction_start_lock = threading.Lock()
+
+@app.before_request
+def ensure_background_compaction():
+    """
+    Start the compaction thread with the first request the process serves. This works the
+    same under `python app.py`, `flask run` and WSGI servers, and the debug reloader's
+    watcher process never serves requests, so it does not start a second thread.
+    """
+    global compaction_started
+    if compaction_started or COMPACTION_INTERVAL_HOURS <= 0:
+        return
+    with compaction_start_lock:
+        if not compaction_started:
+            start_background_compaction(COMPACTION_INTERVAL_HOURS)
+            compaction_started = True
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
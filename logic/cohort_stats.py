@@ -0,0 +1,440 @@
+from typing import Dict, Optional, Tuple
+import hashlib
+import hmac
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from logic.run_log import log_totals
+from logic.file_lock import file_lock
+
+# Monthly income bands (lower bound, label) used to group users into cohorts
+INCOME_BANDS = [
+    (0, '0-25k'),
+    (25000, '25k-50k'),
+    (50000, '50k-1L'),
+    (100000, '1L-2L'),
+    (200000, '2L+')
+]
+# Relative error of every quantile estimate
+SKETCH_RELATIVE_ACCURACY = 0.02
+# Buckets kept per sign before the smallest ones are folded together
+SKETCH_MAX_BUCKETS = 512
+# Magnitudes below this count as zero
+SKETCH_MIN_VALUE = 1e-9
+# Margin for coarse filesystem timestamps when a rebuild splits logs by modification time
+REBUILD_MTIME_SLACK = 2.0
+# Distinct contributor ids kept per metric. Only "at least the minimum cohort size" is ever
+# asked of them, so past this many the set stops growing and the stored stats stay bounded.
+CONTRIBUTOR_CAP = 25
+
+
+def contributor_id(username: str, secret_key: str) -> str:
+    """
+    Stable pseudonymous id, so distinct users can be counted without storing usernames.
+    Keyed with the app secret so it cannot be matched back against users.json.
+    """
+    return hmac.new(secret_key.encode('utf-8'), username.encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+
+
+def income_band(income: float) -> str:
+    """Return the label of the income band containing `income`."""
+    label = INCOME_BANDS[0][1]
+    for lower, band_label in INCOME_BANDS:
+        if income >= lower:
+            label = band_label
+    return label
+
+
+def _contributor_count(contributors: set):
+    """Distinct contributors, or ">=CAP" once the capped set is full and the true number is unknown."""
+    if len(contributors) >= CONTRIBUTOR_CAP:
+        return f">={CONTRIBUTOR_CAP}"
+    return len(contributors)
+
+
+class QuantileSketch:
+    """
+    Log-bucketed quantile sketch (DDSketch style). Adding a value is O(1), two sketches
+    merge by summing bucket counts, and every quantile is within the relative accuracy.
+    Negative values (e.g. savings rates when overspending) get their own buckets.
+    """
+
+    def __init__(self, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def _key(self, magnitude: float) -> int:
+        return math.ceil(math.log(magnitude) / self.log_gamma)
+
+    def _bucket_value(self, key: int) -> float:
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value: float, weight: int = 1):
+        if weight <= 0:
+            return
+        if value > SKETCH_MIN_VALUE:
+            store = self.positive
+            key = self._key(value)
+        elif value < -SKETCH_MIN_VALUE:
+            store = self.negative
+            key = self._key(-value)
+        else:
+            self.zero_count += weight
+            self.count += weight
+            return
+        store[key] = store.get(key, 0) + weight
+        self.count += weight
+        if len(store) > SKETCH_MAX_BUCKETS:
+            self._collapse(store)
+
+    def _collapse(self, store: Dict):
+        """Fold the smallest-magnitude buckets together so the sketch stays bounded."""
+        keys = sorted(store)
+        overflow = len(keys) - SKETCH_MAX_BUCKETS
+        target = keys[overflow]
+        for key in keys[:overflow]:
+            store[target] += store.pop(key)
+
+    def merge(self, other: 'QuantileSketch'):
+        for key, count in other.positive.items():
+            self.positive[key] = self.positive.get(key, 0) + count
+        for key, count in other.negative.items():
+            self.negative[key] = self.negative.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        for store in (self.positive, self.negative):
+            if len(store) > SKETCH_MAX_BUCKETS:
+                self._collapse(store)
+
+    def _ordered_buckets(self):
+        """Yield (value, count) from the most negative bucket to the largest positive one."""
+        for key in sorted(self.negative, reverse=True):
+            yield -self._bucket_value(key), self.negative[key]
+        if self.zero_count:
+            yield 0.0, self.zero_count
+        for key in sorted(self.positive):
+            yield self._bucket_value(key), self.positive[key]
+
+    def quantile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        value = None
+        for value, count in self._ordered_buckets():
+            seen += count
+            if seen > rank:
+                return value
+        return value
+
+    def rank(self, value: float) -> Optional[float]:
+        """Approximate fraction of recorded values that are <= `value`."""
+        if self.count == 0:
+            return None
+        # Compare bucket keys rather than bucket midpoints so `value`'s own bucket counts as <=
+        if value > SKETCH_MIN_VALUE:
+            key = self._key(value)
+            below = (sum(self.negative.values()) + self.zero_count
+                     + sum(c for k, c in self.positive.items() if k <= key))
+        elif value < -SKETCH_MIN_VALUE:
+            key = self._key(-value)
+            below = sum(c for k, c in self.negative.items() if k >= key)
+        else:
+            below = sum(self.negative.values()) + self.zero_count
+        return below / self.count
+
+    def to_dict(self) -> Dict:
+        return {
+            'accuracy': self.relative_accuracy,
+            'zero': self.zero_count,
+            'pos': {str(k): c for k, c in self.positive.items()},
+            'neg': {str(k): c for k, c in self.negative.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'QuantileSketch':
+        sketch = cls(data.get('accuracy', SKETCH_RELATIVE_ACCURACY))
+        sketch.positive = {int(k): c for k, c in data.get('pos', {}).items()}
+        sketch.negative = {int(k): c for k, c in data.get('neg', {}).items()}
+        sketch.zero_count = data.get('zero', 0)
+        sketch.count = sketch.zero_count + sum(sketch.positive.values()) + sum(sketch.negative.values())
+        return sketch
+
+
+class _Metric:
+    """Count, sum, quantile sketch and (up to CONTRIBUTOR_CAP) distinct contributors for one measured value."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.sketch = QuantileSketch()
+        self.contributors = set()
+
+    def add(self, value: float, weight: int, contributor: str):
+        self.count += weight
+        self.total += value * weight
+        self.sketch.add(value, weight)
+        if len(self.contributors) < CONTRIBUTOR_CAP:
+            self.contributors.add(contributor)
+
+    def merge(self, other: '_Metric'):
+        self.count += other.count
+        self.total += other.total
+        self.sketch.merge(other.sketch)
+        for contributor in other.contributors:
+            if len(self.contributors) >= CONTRIBUTOR_CAP:
+                break
+            self.contributors.add(contributor)
+
+    def summary(self) -> Dict:
+        return {
+            'count': self.count,
+            'contributors': _contributor_count(self.contributors),
+            'mean': self.total / self.count if self.count else None,
+            'p25': self.sketch.quantile(0.25),
+            'p50': self.sketch.quantile(0.5),
+            'p75': self.sketch.quantile(0.75),
+            'p90': self.sketch.quantile(0.9)
+        }
+
+    def to_dict(self) -> Dict:
+        return {'count': self.count, 'sum': self.total, 'sketch': self.sketch.to_dict(),
+                'contributors': sorted(self.contributors)}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> '_Metric':
+        metric = cls()
+        metric.count = data.get('count', 0)
+        metric.total = data.get('sum', 0.0)
+        metric.sketch = QuantileSketch.from_dict(data.get('sketch', {}))
+        metric.contributors = set(data.get('contributors', [])[:CONTRIBUTOR_CAP])
+        return metric
+
+
+class _Band:
+    """All metrics of one income band."""
+
+    def __init__(self):
+        self.count = 0
+        self.savings_rate = _Metric()
+        self.emi_to_income = _Metric()
+        self.categories = {}
+
+    @property
+    def contributors(self) -> int:
+        # Every analysis records a savings rate, so its contributors are the band's
+        return len(self.savings_rate.contributors)
+
+    def add(self, contributor: str, category_spend: Dict, savings_rate: float, emi_to_income: float, weight: int):
+        self.count += weight
+        self.savings_rate.add(savings_rate, weight, contributor)
+        self.emi_to_income.add(emi_to_income, weight, contributor)
+        for category, amount in category_spend.items():
+            self.categories.setdefault(category, _Metric()).add(amount, weight, contributor)
+
+    def merge(self, other: '_Band'):
+        self.count += other.count
+        self.savings_rate.merge(other.savings_rate)
+        self.emi_to_income.merge(other.emi_to_income)
+        for category, metric in other.categories.items():
+            self.categories.setdefault(category, _Metric()).merge(metric)
+
+    def summary(self, min_contributors: int) -> Dict:
+        """Categories entered by fewer than `min_contributors` users are left out."""
+        return {
+            'count': self.count,
+            'contributors': _contributor_count(self.savings_rate.contributors),
+            'savings_rate': self.savings_rate.summary(),
+            'emi_to_income': self.emi_to_income.summary(),
+            'categories': {category: metric.summary() for category, metric in sorted(self.categories.items())
+                           if len(metric.contributors) >= min_contributors}
+        }
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'savings_rate': self.savings_rate.to_dict(),
+            'emi_to_income': self.emi_to_income.to_dict(),
+            'categories': {category: metric.to_dict() for category, metric in self.categories.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> '_Band':
+        band = cls()
+        band.count = data.get('count', 0)
+        band.savings_rate = _Metric.from_dict(data.get('savings_rate', {}))
+        band.emi_to_income = _Metric.from_dict(data.get('emi_to_income', {}))
+        band.categories = {category: _Metric.from_dict(metric) for category, metric in data.get('categories', {}).items()}
+        return band
+
+
+class CohortStats:
+    """
+    Streaming per-income-band aggregates of category spend, savings rate and EMI-to-income.
+    Every analysis is one sample, so users who analyze more often weigh more.
+    """
+
+    def __init__(self):
+        self.bands = {}
+
+    def add_observation(self, contributor: str, income: float, category_spend: Dict, savings_rate: float,
+                        emi_total: float, weight: int = 1):
+        """Record one analysis by `contributor`. Cost does not depend on how many analyses came before."""
+        if income <= 0 or weight <= 0:
+            return
+        band = self.bands.setdefault(income_band(income), _Band())
+        band.add(contributor, category_spend, savings_rate, emi_total / income, weight)
+
+    def add_log(self, log: Dict, contributor: str):
+        """
+        Record a per-run log or, for monthly rollups, the sketches of every run it summarizes.
+        `contributor` is the user's contributor_id.
+        """
+        cohort = (log.get('rollup') or {}).get('cohort')
+        if cohort:
+            self.merge(CohortStats.from_dict(cohort))
+            return
+        observation = observation_from_log(log)
+        if observation:
+            self.add_observation(contributor, *observation)
+
+    def merge(self, other: 'CohortStats'):
+        for label, band in other.bands.items():
+            self.bands.setdefault(label, _Band()).merge(band)
+
+    def summary(self, min_contributors: int = 1) -> Dict:
+        """
+        Per-band summaries. Bands, and categories within a band, with fewer than
+        `min_contributors` distinct users are withheld, however many analyses they hold.
+        """
+        return {label: self.bands[label].summary(min_contributors)
+                for _, label in INCOME_BANDS
+                if label in self.bands and self.bands[label].contributors >= min_contributors}
+
+    def percentiles(self, income: float, category_spend: Dict, savings_rate: float, emi_total: float,
+                    min_contributors: int = 1) -> Optional[Dict]:
+        """Where one analysis falls within its income band, as fractions of the cohort at or below it."""
+        band = self.bands.get(income_band(income)) if income > 0 else None
+        if band is None:
+            return None
+        return {
+            'savings_rate': band.savings_rate.sketch.rank(savings_rate),
+            'emi_to_income': band.emi_to_income.sketch.rank(emi_total / income),
+            'categories': {category: band.categories[category].sketch.rank(amount)
+                           for category, amount in category_spend.items()
+                           if category in band.categories
+                           and len(band.categories[category].contributors) >= min_contributors}
+        }
+
+    def to_dict(self) -> Dict:
+        return {'bands': {label: band.to_dict() for label, band in self.bands.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'CohortStats':
+        stats = cls()
+        stats.bands = {label: _Band.from_dict(band) for label, band in data.get('bands', {}).items()}
+        return stats
+
+
+def observation_from_log(log: Dict) -> Optional[Tuple[float, Dict, float, float, int]]:
+    """
+    Turn a stored log into (income, category_spend, savings_rate, emi_total, weight).
+    Monthly rollups carry their own cohort sketches, which CohortStats.add_log merges
+    directly. For a rollup this gives the month's means, weighted by its run count,
+    which is only right for count and mean; it is the fallback for rollups written
+    before sketches were kept, and what /api/cohort_stats shows as "you".
+    """
+    rollup = log.get('rollup')
+    if rollup:
+        runs = rollup.get('runs', 0)
+        if not runs:
+            return None
+        return (
+            (rollup.get('income') or {}).get('mean') or 0,
+            rollup.get('category_expenses', {}),
+            (rollup.get('savings_rate') or {}).get('mean') or 0,
+            (rollup.get('emi_total') or {}).get('mean') or 0,
+            runs
+        )
+    totals = log_totals(log)
+    return totals['income'], totals['category_expenses'], totals['savings_rate'], totals['emi_total'], 1
+
+
+def load_cohort_stats(path: str) -> CohortStats:
+    if not os.path.exists(path):
+        return CohortStats()
+    with open(path, 'r', encoding='utf-8') as f:
+        return CohortStats.from_dict(json.load(f))
+
+
+def save_cohort_stats(stats: CohortStats, path: str):
+    """Persist compactly (sparse buckets, no indentation) and swap the file in atomically."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(stats.to_dict(), f, separators=(',', ':'), ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def cohort_lock_path(stats_path: str) -> str:
+    """Lock file held by every writer of the stats file: /analyze updates and rebuilds."""
+    return f"{stats_path}.lock"
+
+
+def _add_user_logs(stats: CohortStats, user_dir: str, secret_key: str, before: Optional[float] = None,
+                   since: Optional[float] = None):
+    """Add the user's logs last modified before `before` and/or at or after `since`."""
+    contributor = contributor_id(os.path.basename(user_dir), secret_key)
+    for f in sorted(os.listdir(user_dir)):
+        if not f.endswith('.json'):
+            continue
+        path = os.path.join(user_dir, f)
+        try:
+            mtime = os.path.getmtime(path)
+            if (before is not None and mtime >= before) or (since is not None and mtime < since):
+                continue
+            with open(path, 'r', encoding='utf-8') as fp:
+                stats.add_log(json.load(fp), contributor)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+
+
+def build_user_cohort_stats(user_dir: str, secret_key: str, before: Optional[float] = None) -> Dict:
+    """Aggregate one user's logs; runs in a worker process during a rebuild."""
+    stats = CohortStats()
+    _add_user_logs(stats, user_dir, secret_key, before=before)
+    return stats.to_dict()
+
+
+def rebuild_cohort_stats(data_dir: str, stats_path: str, secret_key: str, workers: Optional[int] = None,
+                         lock_timeout: float = 60.0) -> CohortStats:
+    """
+    Recompute all cohort sketches from the logs under data/, one user per worker, then merge.
+
+    Workers only read logs older than the rebuild's start. Logs written since then are
+    added while holding the stats lock, just before the file is replaced. /analyze writes
+    its log and records it under that same lock, so every log is counted exactly once.
+    Callers must also hold the compaction lock so monthly rollups stay put meanwhile.
+    """
+    cutoff = time.time() - REBUILD_MTIME_SLACK
+    user_dirs = [os.path.join(data_dir, name) for name in sorted(os.listdir(data_dir))
+                 if os.path.isdir(os.path.join(data_dir, name))]
+    stats = CohortStats()
+    if user_dirs:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for partial in executor.map(build_user_cohort_stats, user_dirs,
+                                        [secret_key] * len(user_dirs), [cutoff] * len(user_dirs)):
+                stats.merge(CohortStats.from_dict(partial))
+    with file_lock(cohort_lock_path(stats_path), timeout=lock_timeout):
+        for name in sorted(os.listdir(data_dir)):
+            user_dir = os.path.join(data_dir, name)
+            if os.path.isdir(user_dir):
+                _add_user_logs(stats, user_dir, secret_key, since=cutoff)
+        save_cohort_stats(stats, stats_path)
+    return stats
@@ -0,0 +1,49 @@
+from contextlib import contextmanager
+import os
+import time
+
+# Seconds between attempts while another process holds the lock
+POLL_INTERVAL = 0.05
+
+
+def acquire_file_lock(path: str, timeout: float = 10.0, stale_after: float = 60.0) -> bool:
+    """
+    Take a cross-process lock by creating `path` exclusively, waiting up to `timeout` seconds.
+    A lock file older than `stale_after` seconds is assumed to belong to a crashed process.
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > stale_after:
+                    os.remove(path)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() >= deadline:
+                return False
+            time.sleep(POLL_INTERVAL)
+            continue
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(os.getpid()))
+        return True
+
+
+def release_file_lock(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@contextmanager
+def file_lock(path: str, timeout: float = 10.0, stale_after: float = 60.0):
+    """Hold the lock for the body of a `with` block; raises TimeoutError if it cannot be taken."""
+    if not acquire_file_lock(path, timeout, stale_after):
+        raise TimeoutError(f"Timed out waiting for lock {path}")
+    try:
+        yield
+    finally:
+        release_file_lock(path)
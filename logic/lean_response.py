@@ -0,0 +1,66 @@
+from typing import List, Dict, Optional
+
+# Computed fields returned as-is in lean mode; inputs the client sent are never echoed back
+LEAN_FIELDS = [
+    'balance', 'savings_rate', 'amount_saved', 'total_possible_savings',
+    'gap_remaining', 'goal_met', 'status_message', 'advice', 'smart_model_summary'
+]
+
+
+def optimized_expense_deltas(expenses: List[Dict], optimized_expenses: List[Dict]) -> List[Dict]:
+    """
+    Describe optimized expenses as changes against the request's `expenses` list.
+    `optimized_expenses` is the fixed expenses followed by the reducible ones, each
+    in input order, so positions line up with those input indices.
+    Only expenses whose amount changed are listed.
+    """
+    input_indices = [i for i, e in enumerate(expenses) if e.get('expense_type') == 'Fixed']
+    input_indices += [i for i, e in enumerate(expenses) if e.get('expense_type') == 'Reducible']
+    deltas = []
+    for index, optimized in zip(input_indices, optimized_expenses):
+        original_amount = expenses[index].get('amount', 0)
+        new_amount = optimized.get('amount', 0)
+        if new_amount != original_amount:
+            deltas.append({
+                'index': index,
+                'amount': new_amount,
+                'delta': round(new_amount - original_amount, 2)
+            })
+    return deltas
+
+
+def emi_recommendation_refs(emi_plans: List[Dict], emi_recommendation: Dict) -> Dict:
+    """Replace echoed EMI plan objects with indices into the request's `emi_plans` list."""
+    positions = {id(plan): i for i, plan in enumerate(emi_plans)}
+    selected = emi_recommendation.get('selected_plans', []) if emi_recommendation else []
+    alternatives = emi_recommendation.get('alternative_plans', []) if emi_recommendation else []
+    return {
+        'selected_plans': [positions[id(p)] for p in selected if id(p) in positions],
+        'alternative_plans': [positions[id(p)] for p in alternatives if id(p) in positions],
+        'monthly_total': sum(p.get('monthlyPayment', 0) for p in selected),
+        'recommendation': emi_recommendation.get('recommendation', '') if emi_recommendation else ''
+    }
+
+
+def lean_results(results: Dict, expenses: List[Dict], emi_plans: List[Dict]) -> Dict:
+    """Build the lean /analyze payload: computed fields only, with references instead of echoed inputs."""
+    lean = {field: results.get(field) for field in LEAN_FIELDS}
+    lean['optimized_expense_deltas'] = optimized_expense_deltas(expenses, results.get('optimized_expenses', []))
+    lean['emi_recommendation'] = emi_recommendation_refs(emi_plans, results.get('emi_recommendation'))
+    return lean
+
+
+def select_fields(payload: Dict, fields: Optional[List[str]]) -> Dict:
+    """Keep only the requested top-level fields; unknown names are ignored."""
+    if not fields:
+        return payload
+    return {field: payload[field] for field in fields if field in payload}
+
+
+def parse_fields(value) -> Optional[List[str]]:
+    """Accept `fields` as a comma-separated string or a JSON list."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    return [str(field).strip() for field in value if str(field).strip()]
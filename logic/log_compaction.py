@@ -0,0 +1,250 @@
+from typing import List, Dict, Optional
+import json
+import os
+import re
+from datetime import datetime
+from logic.report_index import list_reports, remove_reports
+from logic.run_log import log_totals
+from logic.cohort_stats import CohortStats, contributor_id
+
+# Per-run log:      data/<user>/<user>_YYYY_MM_DD_HHMMSS.json
+RUN_LOG_PATTERN = r'^{user}_(\d{{4}})_(\d{{2}})_\d{{2}}_\d{{6}}\.json$'
+
+LOCK_NAME = '.compaction.lock'
+# Drop a lock left behind by a crashed run after this many seconds
+STALE_LOCK_SECONDS = 3600
+
+
+def _write_json_atomic(path: str, payload: Dict):
+    """Write JSON next to the target and swap it in, so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _remove_quietly(path: str) -> bool:
+    """Delete a file, tolerating it having already been removed by someone else."""
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def acquire_compaction_lock(root: str) -> Optional[str]:
+    """
+    Create an exclusive lock file so two compaction jobs never overlap. A cohort rebuild
+    holds it too, so monthly rollups do not change underneath its scan.
+    """
+    lock_path = os.path.join(root, LOCK_NAME)
+    try:
+        if datetime.now().timestamp() - os.path.getmtime(lock_path) > STALE_LOCK_SECONDS:
+            _remove_quietly(lock_path)
+    except OSError:
+        pass
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+    with os.fdopen(fd, 'w') as f:
+        f.write(str(os.getpid()))
+    return lock_path
+
+
+def release_compaction_lock(lock_path: str):
+    _remove_quietly(lock_path)
+
+
+def _new_stat() -> Dict:
+    return {'sum': 0.0, 'min': None, 'max': None}
+
+
+def _add_stat(stat: Dict, value: float):
+    stat['sum'] += value
+    stat['min'] = value if stat['min'] is None else min(stat['min'], value)
+    stat['max'] = value if stat['max'] is None else max(stat['max'], value)
+
+
+class _MonthAccumulator:
+    """
+    Running totals for one month; holds a single log at a time, never the whole month.
+    Also keeps the month's cohort sketches so compaction does not lose the distribution.
+    """
+
+    FIELDS = ['income', 'balance', 'savings_rate', 'total_expenses', 'emi_total']
+
+    def __init__(self, contributor: str):
+        self.contributor = contributor
+        self.cohort = CohortStats()
+        self.runs = 0
+        self.first_run = None
+        self.last_run = None
+        self.latest_log = None
+        self.stats = {field: _new_stat() for field in self.FIELDS}
+        self.category_sums = {}
+
+    def add_log(self, log: Dict, run_id: str):
+        totals = log_totals(log)
+        for field in self.FIELDS:
+            _add_stat(self.stats[field], totals[field])
+        for cat, amount in totals['category_expenses'].items():
+            self.category_sums[cat] = self.category_sums.get(cat, 0) + amount
+        self.cohort.add_log(log, self.contributor)
+        self.runs += 1
+        self._track_run(run_id, log)
+
+    def add_rollup(self, log: Dict):
+        """Fold in an existing monthly file (either an earlier rollup or a legacy monthly log)."""
+        rollup = log.get('rollup')
+        if not rollup:
+            self.add_log(log, '')
+            return
+        runs = rollup.get('runs', 0)
+        for field in self.FIELDS:
+            previous = rollup.get(field)
+            if not previous or previous.get('min') is None:
+                continue
+            stat = self.stats[field]
+            stat['sum'] += previous.get('mean', 0) * runs
+            stat['min'] = previous['min'] if stat['min'] is None else min(stat['min'], previous['min'])
+            stat['max'] = previous['max'] if stat['max'] is None else max(stat['max'], previous['max'])
+        for cat, mean in rollup.get('category_expenses', {}).items():
+            self.category_sums[cat] = self.category_sums.get(cat, 0) + mean * runs
+        self.cohort.add_log(log, self.contributor)
+        self.runs += runs
+        first_run = rollup.get('first_run')
+        if first_run and (self.first_run is None or first_run < self.first_run):
+            self.first_run = first_run
+        self._track_run(rollup.get('last_run') or '', log)
+
+    def _track_run(self, run_id: str, log: Dict):
+        if run_id and (self.first_run is None or run_id < self.first_run):
+            self.first_run = run_id
+        if self.latest_log is None or (run_id and (self.last_run is None or run_id >= self.last_run)):
+            self.latest_log = log
+            if run_id:
+                self.last_run = run_id
+
+    def to_log(self) -> Dict:
+        """Monthly file: the latest run's fields (so history/score readers keep working) plus a rollup."""
+        log = {k: v for k, v in (self.latest_log or {}).items() if k != 'rollup'}
+        runs = max(self.runs, 1)
+        rollup = {
+            'runs': self.runs,
+            'first_run': self.first_run,
+            'last_run': self.last_run,
+            'category_expenses': {cat: total / runs for cat, total in self.category_sums.items()},
+        }
+        for field, stat in self.stats.items():
+            rollup[field] = {'mean': stat['sum'] / runs, 'min': stat['min'], 'max': stat['max']}
+        rollup['cohort'] = self.cohort.to_dict()
+        log['rollup'] = rollup
+        return log
+
+
+def compact_user_logs(user_dir: str, username: str, keep_runs: int, secret_key: str) -> Dict:
+    """
+    Roll all but the newest `keep_runs` per-run logs of one user into monthly files.
+    A raw log is deleted only after the monthly file containing it has been written.
+    """
+    run_re = re.compile(RUN_LOG_PATTERN.format(user=re.escape(username)))
+    runs = sorted(f for f in os.listdir(user_dir) if run_re.match(f))
+    to_compact = runs[:-keep_runs] if keep_runs > 0 else runs
+    by_month = {}
+    for f in to_compact:
+        year, month = run_re.match(f).groups()
+        by_month.setdefault(f"{year}_{month}", []).append(f)
+
+    summary = {'runs_compacted': 0, 'months_written': 0, 'months_skipped': 0}
+    for month_key, files in sorted(by_month.items()):
+        acc = _MonthAccumulator(contributor_id(username, secret_key))
+        # Monthly rollups use the same name as the legacy monthly logs: <user>_YYYY_MM.json
+        monthly_path = os.path.join(user_dir, f"{username}_{month_key}.json")
+        last_folded = None
+        try:
+            with open(monthly_path, 'r', encoding='utf-8') as fp:
+                existing = json.load(fp)
+        except FileNotFoundError:
+            existing = None
+        except json.JSONDecodeError:
+            # Leave the month (and its raw logs) alone rather than overwrite an unreadable rollup
+            summary['months_skipped'] += 1
+            continue
+        if existing is not None:
+            acc.add_rollup(existing)
+            last_folded = (existing.get('rollup') or {}).get('last_run')
+        compacted = []
+        already_folded = []
+        for f in files:
+            run_id = f[len(username) + 1:-len('.json')]
+            if last_folded and run_id <= last_folded:
+                # Folded in by an earlier run that stopped before deleting the raw log
+                already_folded.append(f)
+                continue
+            try:
+                with open(os.path.join(user_dir, f), 'r', encoding='utf-8') as fp:
+                    log = json.load(fp)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            acc.add_log(log, run_id)
+            compacted.append(f)
+        if compacted:
+            _write_json_atomic(monthly_path, acc.to_log())
+            summary['months_written'] += 1
+        for f in compacted + already_folded:
+            if _remove_quietly(os.path.join(user_dir, f)):
+                summary['runs_compacted'] += 1
+    return summary
+
+
+def prune_reports(results_dir: str, users_dir: str, username: str, keep_reports: int) -> Dict:
+    """
+    Keep only the newest `keep_reports` saved reports of one user, found via their report index.
+    A report listed twice by an older index counts once, and the rewrite drops the duplicate.
+    """
+    filenames = list_reports(users_dir, results_dir, username)
+    stale = filenames[:-keep_reports] if keep_reports > 0 else filenames
+    removed = 0
+    for f in stale:
+        if _remove_quietly(os.path.join(results_dir, f)):
+            removed += 1
+    if stale:
+        remove_reports(users_dir, username, stale)
+    return {'reports_removed': removed}
+
+
+def compact_storage(data_dir: str = 'data', results_dir: str = 'results', users_dir: str = 'users',
+                    keep_runs: int = 6, keep_reports: Optional[int] = None,
+                    users: Optional[List[str]] = None, *, secret_key: str) -> Dict:
+    """
+    Compact every user's logs under data/ and, if `keep_reports` is given, prune older
+    reports under results/ (pruned reports are gone from /api/export too).
+    Safe to run while the app is serving: new runs are never touched, monthly files are
+    replaced atomically, and a lock file keeps two compaction jobs from overlapping.
+    `secret_key` keys the contributor ids stored in the rollups' cohort sketches.
+    """
+    lock_path = acquire_compaction_lock(data_dir)
+    if lock_path is None:
+        return {'skipped': True, 'reason': 'Another compaction is already running.'}
+    try:
+        summary = {'users': 0, 'runs_compacted': 0, 'months_written': 0, 'months_skipped': 0, 'reports_removed': 0}
+        names = users if users is not None else sorted(os.listdir(data_dir))
+        for username in names:
+            user_dir = os.path.join(data_dir, username)
+            if not os.path.isdir(user_dir):
+                continue
+            user_summary = compact_user_logs(user_dir, username, keep_runs, secret_key)
+            summary['users'] += 1
+            summary['runs_compacted'] += user_summary['runs_compacted']
+            summary['months_written'] += user_summary['months_written']
+            summary['months_skipped'] += user_summary['months_skipped']
+        if keep_reports is not None and os.path.isdir(results_dir):
+            report_users = users if users is not None else sorted(os.listdir(users_dir))
+            for username in report_users:
+                if os.path.isdir(os.path.join(users_dir, username)):
+                    pruned = prune_reports(results_dir, users_dir, username, keep_reports)
+                    summary['reports_removed'] += pruned['reports_removed']
+        return summary
+    finally:
+        release_compaction_lock(lock_path)
@@ -0,0 +1,129 @@
+from typing import List, Optional
+import os
+import re
+from datetime import datetime
+from logic.file_lock import file_lock
+
+# One saved-report filename per line, oldest first: users/<user>/reports.idx
+INDEX_NAME = 'reports.idx'
+# Every writer of a user's index (append, migration, pruning) holds this lock file
+INDEX_LOCK_NAME = 'reports.idx.lock'
+# <prefix>_YYYYMMDD_HHMMSS.json, with _<n> added for further reports saved in the same second
+REPORT_TIMESTAMP_PATTERN = re.compile(r'_(\d{8}_\d{6})(?:_(\d+))?\.json$')
+
+
+def report_prefix(user_name: str) -> str:
+    """Filename prefix used for a user's reports in results/."""
+    safe_filename = "".join(c for c in user_name if c.isalnum() or c in (' ', '-', '_')).strip()
+    return safe_filename.replace(' ', '_').lower()
+
+
+def report_timestamp(filename: str) -> Optional[datetime]:
+    """Parse the run time encoded in a report filename."""
+    match = REPORT_TIMESTAMP_PATTERN.search(filename)
+    if not match:
+        return None
+    return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+
+
+def _report_sort_key(filename: str):
+    match = REPORT_TIMESTAMP_PATTERN.search(filename)
+    if not match:
+        return (filename, 0)
+    return (match.group(1), int(match.group(2) or 0))
+
+
+def reserve_report_filename(results_dir: str, user_name: str, timestamp: str) -> str:
+    """
+    Claim an unused report filename by creating it exclusively, so two saves in the
+    same second get separate files (and separate index entries) instead of one overwrite.
+    """
+    prefix = report_prefix(user_name)
+    n = 0
+    while True:
+        filename = f"{prefix}_{timestamp}.json" if n == 0 else f"{prefix}_{timestamp}_{n + 1}.json"
+        try:
+            os.close(os.open(os.path.join(results_dir, filename), os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return filename
+        except FileExistsError:
+            n += 1
+
+
+def _index_path(users_dir: str, username: str) -> str:
+    return os.path.join(users_dir, username, INDEX_NAME)
+
+
+def _index_lock(users_dir: str, username: str):
+    user_dir = os.path.join(users_dir, username)
+    os.makedirs(user_dir, exist_ok=True)
+    return file_lock(os.path.join(user_dir, INDEX_LOCK_NAME))
+
+
+def _read_index(path: str) -> List[str]:
+    """Index entries in order, each once (older indexes may list a report twice)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return list(dict.fromkeys(line.strip() for line in f if line.strip()))
+
+
+def _last_entry(path: str) -> Optional[str]:
+    """Read only the tail of the index to find its newest entry."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - 1024))
+        lines = [line.strip() for line in f.read().decode('utf-8', 'ignore').splitlines() if line.strip()]
+    return lines[-1] if lines else None
+
+
+def _write_index(users_dir: str, username: str, filenames: List[str]):
+    """Replace the whole index atomically. Callers hold the index lock."""
+    path = _index_path(users_dir, username)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.writelines(name + '\n' for name in filenames)
+    os.replace(tmp_path, path)
+
+
+def _build_index(users_dir: str, results_dir: str, username: str) -> List[str]:
+    """One-time migration for users whose reports predate the index: scan results/ once. Callers hold the index lock."""
+    pattern = re.compile(rf'^{re.escape(report_prefix(username))}_\d{{8}}_\d{{6}}(?:_\d+)?\.json$')
+    filenames = []
+    if os.path.isdir(results_dir):
+        filenames = sorted((f for f in os.listdir(results_dir) if pattern.match(f)), key=_report_sort_key)
+    _write_index(users_dir, username, filenames)
+    return filenames
+
+
+def list_reports(users_dir: str, results_dir: str, username: str) -> List[str]:
+    """Return the user's report filenames, oldest first, without scanning results/."""
+    path = _index_path(users_dir, username)
+    if not os.path.exists(path):
+        with _index_lock(users_dir, username):
+            if not os.path.exists(path):
+                return _build_index(users_dir, results_dir, username)
+    return _read_index(path)
+
+
+def append_report(users_dir: str, results_dir: str, username: str, filename: str):
+    """
+    Record a newly saved report. Appending keeps this O(1) per analysis; a user without
+    an index yet gets it built from results/ first so their older reports are not lost.
+    """
+    path = _index_path(users_dir, username)
+    with _index_lock(users_dir, username):
+        if not os.path.exists(path):
+            if filename in _build_index(users_dir, results_dir, username):
+                return
+        elif _last_entry(path) == filename:
+            return
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(filename + '\n')
+
+
+def remove_reports(users_dir: str, username: str, filenames: List[str]):
+    """Drop entries from the index. The index lock keeps appends from landing mid-rewrite."""
+    path = _index_path(users_dir, username)
+    removed = set(filenames)
+    with _index_lock(users_dir, username):
+        if not os.path.exists(path):
+            return
+        _write_index(users_dir, username, [name for name in _read_index(path) if name not in removed])
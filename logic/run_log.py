@@ -0,0 +1,37 @@
+from typing import Dict
+from logic.dp_emi_selector import dp_emi_selector
+
+# Helpers for reading the per-run logs /analyze writes to data/<user>/
+
+
+def selected_emi_total(log: Dict) -> float:
+    """
+    Monthly EMI of the plans dp_emi_selector chose, not of every candidate plan entered.
+    Older logs stored no selection, so it is recomputed; the selector is deterministic,
+    so this gives the same answer the run itself got.
+    """
+    selected = log.get('selected_emis') or []
+    emi_plans = log.get('emi_plans') or []
+    income = log.get('income', 0) or 0
+    if not selected and emi_plans and income > 0:
+        try:
+            selected = dp_emi_selector(emi_plans, income).get('selected_plans', [])
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            selected = []
+    return sum(p.get('monthlyPayment', 0) for p in selected)
+
+
+def log_totals(log: Dict) -> Dict:
+    """Reduce one per-run log to the numbers kept in a monthly rollup."""
+    category_expenses = {}
+    for e in log.get('fixed_expenses', []) + log.get('reducible_expenses', []):
+        cat = e.get('category', 'Other')
+        category_expenses[cat] = category_expenses.get(cat, 0) + e.get('amount', 0)
+    return {
+        'income': log.get('income', 0) or 0,
+        'balance': log.get('balance', 0) or 0,
+        'savings_rate': log.get('savings_rate', 0) or 0,
+        'total_expenses': sum(category_expenses.values()),
+        'emi_total': selected_emi_total(log),
+        'category_expenses': category_expenses,
+    }
@@ -0,0 +1,55 @@
+"""
+Compare full and lean /analyze payload sizes for the sample statements in bank/.
+
+Run from anywhere: python scripts/payload_sizes.py
+"""
+import gzip
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# app.py resolves data/, results/ and bank/ relative to the working directory
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+from app import build_analysis_results  # noqa: E402
+from logic.lean_response import lean_results  # noqa: E402
+
+# Sample inputs used to measure /analyze payloads against each statement in bank/
+SAMPLE_SALARY = 50000.0
+SAMPLE_TARGET = 10000.0
+SAMPLE_EXPENSES = [
+    {"expense_type": "Fixed", "category": "Food", "name": "Groceries", "amount": 5000, "priority": ""},
+    {"expense_type": "Fixed", "category": "Housing", "name": "Rent", "amount": 15000, "priority": ""},
+    {"expense_type": "Reducible", "category": "Transportation", "name": "cab", "amount": 3000, "priority": "High"},
+    {"expense_type": "Reducible", "category": "Entertainment", "name": "movie", "amount": 2000, "priority": "Low"}
+]
+SAMPLE_EMI_PLANS = [
+    {"name": "Home Loan", "amount": 500000, "interestRate": 8.5, "durationMonths": 240, "necessity": 8, "monthlyPayment": 4339.12},
+    {"name": "Car Loan", "amount": 200000, "interestRate": 9.2, "durationMonths": 60, "necessity": 6, "monthlyPayment": 4171.11}
+]
+
+
+def payload_sizes(bank_statement: dict):
+    """Return ((full, full.gz), (lean, lean.gz)) byte sizes of the /analyze body for one statement."""
+    results = build_analysis_results('sample', SAMPLE_SALARY, SAMPLE_EXPENSES, SAMPLE_EMI_PLANS,
+                                     bank_statement, SAMPLE_TARGET, use_ai=False)
+    sizes = []
+    for payload in (results, lean_results(results, SAMPLE_EXPENSES, SAMPLE_EMI_PLANS)):
+        body = json.dumps({'success': True, 'results': payload, 'filename': ''}, separators=(',', ':')).encode('utf-8')
+        sizes.append((len(body), len(gzip.compress(body))))
+    return sizes
+
+
+def main():
+    print(f"{'statement':<24}{'full':>8}{'lean':>8}{'full.gz':>9}{'lean.gz':>9}")
+    for statement_file in sorted(f for f in os.listdir('bank') if f.endswith('.json')):
+        with open(os.path.join('bank', statement_file), 'r', encoding='utf-8') as f:
+            bank_statement = json.load(f)
+        full, lean = payload_sizes(bank_statement)
+        print(f"{statement_file:<24}{full[0]:>8}{lean[0]:>8}{full[1]:>9}{lean[1]:>9}")
+
+
+if __name__ == '__main__':
+    main()